@@ -0,0 +1,1416 @@
+#!/usr/bin/env python
+# Copyright 2013-2015 Jake Valletta (@jake_valletta)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# API for reading APK contents without unpacking them
+
+import fnmatch
+import hashlib
+import os
+import re
+import shutil
+import struct
+import threading
+import zipfile
+
+from collections import OrderedDict
+
+from xml.sax.saxutils import escape, quoteattr
+
+_TAG = "ApkFile"
+
+MANIFEST_NAME = "AndroidManifest.xml"
+RESOURCES_NAME = "resources.arsc"
+
+DEX_ENTRY_RE = re.compile(r'^classes(\d*)\.dex$')
+SIGNATURE_PATTERNS = ["META-INF/*.RSA", "META-INF/*.DSA", "META-INF/*.EC"]
+
+# APK Signing Block
+EOCD_MAGIC = "PK\x05\x06"
+EOCD_SIZE = 22
+SIG_BLOCK_MAGIC = "APK Sig Block 42"
+SIG_BLOCK_V2_ID = 0x7109871a
+SIG_BLOCK_V3_ID = 0xf05368c0
+
+# DER tags
+DER_INTEGER = 0x02
+DER_OID = 0x06
+DER_SEQUENCE = 0x30
+DER_SET = 0x31
+DER_CONTEXT_0 = 0xa0
+
+OID_SIGNED_DATA = "1.2.840.113549.1.7.2"
+
+# Attribute names, as OpenSSL prints them
+X509_NAMES = {
+    "2.5.4.3": "CN",
+    "2.5.4.4": "SN",
+    "2.5.4.5": "serialNumber",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.9": "street",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+    "2.5.4.12": "title",
+    "2.5.4.17": "postalCode",
+    "2.5.4.42": "GN",
+    "2.5.4.43": "initials",
+    "2.5.4.44": "generationQualifier",
+    "2.5.4.46": "dnQualifier",
+    "2.5.4.65": "pseudonym",
+    "1.2.840.113549.1.9.1": "emailAddress",
+    "0.9.2342.19200300.100.1.1": "UID",
+    "0.9.2342.19200300.100.1.25": "DC"}
+
+# String types and their encodings
+X509_STRINGS = {
+    0x0c: "utf-8",       # UTF8String
+    0x12: "latin-1",     # NumericString
+    0x13: "latin-1",     # PrintableString
+    0x14: "latin-1",     # T61String
+    0x16: "latin-1",     # IA5String
+    0x1a: "latin-1",     # VisibleString
+    0x1c: "utf-32-be",   # UniversalString
+    0x1e: "utf-16-be"}   # BMPString
+
+# ELF
+ELF_MAGIC = "\x7fELF"
+ELF_CLASS_32 = 1
+ELF_CLASS_64 = 2
+ELF_DATA_LSB = 1
+ELF_DATA_MSB = 2
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+MAX_ELF_STRTAB_SIZE = 16 * 1024 * 1024
+
+# e_machine values, by ELF class
+ELF_MACHINES = {
+    (ELF_CLASS_32, 3): "x86",
+    (ELF_CLASS_32, 8): "mips",
+    (ELF_CLASS_64, 8): "mips64",
+    (ELF_CLASS_32, 40): "arm",
+    (ELF_CLASS_64, 62): "x86_64",
+    (ELF_CLASS_64, 183): "arm64"}
+
+# Parsed signatures, keyed by signature file hash
+MAX_CACHED_SIGNATURES = 4096
+
+# Shared handles, one per APK path
+MAX_OPEN_HANDLES = 64
+COPY_BUFFER_SIZE = 64 * 1024
+
+ANDROID_NS = "http://schemas.android.com/apk/res/android"
+
+NO_ENTRY = 0xffffffff
+
+# Chunk types
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_NAMESPACE_TYPE = 0x0100
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_END_ELEMENT_TYPE = 0x0103
+RES_XML_CDATA_TYPE = 0x0104
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+# String pool flags
+UTF8_FLAG = 0x100
+
+# Table type and entry flags
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+ENTRY_FLAG_COMPLEX = 0x0001
+ENTRY_FLAG_COMPACT = 0x0008
+
+# Res_value data types
+TYPE_NULL = 0x00
+TYPE_REFERENCE = 0x01
+TYPE_ATTRIBUTE = 0x02
+TYPE_STRING = 0x03
+TYPE_FLOAT = 0x04
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+TYPE_FIRST_COLOR_INT = 0x1c
+TYPE_LAST_COLOR_INT = 0x1f
+
+# android: attribute resource IDs
+ATTR_SHARED_USER_ID = 0x0101000b
+ATTR_DEBUGGABLE = 0x0101000f
+ATTR_MIN_SDK_VERSION = 0x0101020c
+ATTR_VERSION_CODE = 0x0101021b
+ATTR_VERSION_NAME = 0x0101021c
+ATTR_TARGET_SDK_VERSION = 0x01010270
+ATTR_ALLOW_BACKUP = 0x01010280
+
+MAX_REFERENCE_DEPTH = 8
+
+_HANDLES = OrderedDict()
+_HANDLES_LOCK = threading.Lock()
+
+_SIGNATURES = dict()
+_SIGNATURES_LOCK = threading.Lock()
+
+# Exceptions
+class ApkFileException(Exception):
+
+    def __init__(self, message):
+
+        # Call the base class constructor with the parameters it needs
+        Exception.__init__(self, message)
+
+
+#### Binary XML ########################################
+class StringPool(object):
+
+    """ResStringPool reader, decoding strings on demand"""
+
+    def __init__(self, data, offset):
+
+        (chunk_type, header_size, size, string_count, style_count, flags,
+         strings_start, styles_start) = struct.unpack_from('<HHIIIIII',
+                                                           data, offset)
+
+        if chunk_type != RES_STRING_POOL_TYPE:
+            raise ApkFileException("Expected string pool at %d!" % offset)
+
+        self._data = data
+        self._utf8 = (flags & UTF8_FLAG) != 0
+        self._strings_start = offset + strings_start
+        self._offsets = struct.unpack_from('<%dI' % string_count, data,
+                                           offset + header_size)
+        self._cache = dict()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def get(self, index):
+
+        """Get a string by index, or None"""
+
+        if index >= len(self._offsets):
+            return None
+
+        if index in self._cache:
+            return self._cache[index]
+
+        data = self._data
+        pos = self._strings_start + self._offsets[index]
+
+        if self._utf8:
+            # UTF-16 length first (unused), then the UTF-8 byte length.
+            pos += 2 if ord(data[pos]) & 0x80 else 1
+
+            length = ord(data[pos])
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | ord(data[pos + 1])
+                pos += 2
+            else:
+                pos += 1
+
+            value = data[pos:pos + length].decode('utf-8', 'replace')
+        else:
+            length = struct.unpack_from('<H', data, pos)[0]
+            pos += 2
+            if length & 0x8000:
+                length = (((length & 0x7fff) << 16) |
+                          struct.unpack_from('<H', data, pos)[0])
+                pos += 2
+
+            value = data[pos:pos + length * 2].decode('utf-16-le', 'replace')
+
+        self._cache[index] = value
+        return value
+
+class AxmlAttribute(object):
+
+    """A single attribute of a binary XML element"""
+
+    namespace = None
+    name = ""
+    resource_id = 0
+    raw_value = None
+    value_type = TYPE_NULL
+    data = 0
+
+    def __init__(self, namespace, name, resource_id, raw_value, value_type,
+                 data):
+
+        self.namespace = namespace
+        self.name = name
+        self.resource_id = resource_id
+        self.raw_value = raw_value
+        self.value_type = value_type
+        self.data = data
+
+    def matches(self, name, resource_id):
+
+        """Match by resource ID, or android:<name> when IDs are missing"""
+
+        if self.resource_id:
+            return self.resource_id == resource_id
+
+        return self.namespace == ANDROID_NS and self.name == name
+
+def iterXmlEvents(data):
+
+    """Yield (chunk type, depth, name, value) events for binary XML"""
+
+    # START_NAMESPACE: name is the prefix, value the URI.
+    # START_ELEMENT: value is the list of attributes.
+    # END_ELEMENT: value is None.
+    # CDATA: name is None, value is the text.
+
+    try:
+        chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    except struct.error:
+        raise ApkFileException("Binary XML is truncated!")
+
+    if chunk_type != RES_XML_TYPE:
+        raise ApkFileException("Not a binary XML file!")
+
+    strings = None
+    resource_map = ()
+    depth = 0
+    pos = header_size
+    end = min(size, len(data))
+
+    try:
+        while pos + 8 <= end:
+
+            chunk_type, header_size, chunk_size = struct.unpack_from('<HHI',
+                                                                    data, pos)
+            if chunk_size < 8:
+                raise ApkFileException("Bad chunk size at %d!" % pos)
+
+            if chunk_type == RES_STRING_POOL_TYPE:
+                strings = StringPool(data, pos)
+
+            elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+                count = (chunk_size - header_size) / 4
+                resource_map = struct.unpack_from('<%dI' % count, data,
+                                                  pos + header_size)
+
+            elif chunk_type == RES_XML_START_ELEMENT_TYPE:
+                if strings is None:
+                    raise ApkFileException("Element before string pool!")
+
+                depth += 1
+                ext = pos + header_size
+
+                (ns_index, name_index, attribute_start, attribute_size,
+                 attribute_count) = struct.unpack_from('<IIHHH', data, ext)
+
+                attributes = list()
+                attr_pos = ext + attribute_start
+
+                for i in range(attribute_count):
+
+                    (attr_ns, attr_name, attr_raw, value_size, res0,
+                     value_type, value_data) = struct.unpack_from(
+                                            '<IIIHBBI', data, attr_pos)
+                    attr_pos += attribute_size
+
+                    if attr_name < len(resource_map):
+                        resource_id = resource_map[attr_name]
+                    else:
+                        resource_id = 0
+
+                    attributes.append(AxmlAttribute(
+                            strings.get(attr_ns) if attr_ns != NO_ENTRY
+                                                        else None,
+                            strings.get(attr_name), resource_id,
+                            strings.get(attr_raw) if attr_raw != NO_ENTRY
+                                                        else None,
+                            value_type, value_data))
+
+                yield (RES_XML_START_ELEMENT_TYPE, depth,
+                       strings.get(name_index), attributes)
+
+            elif chunk_type == RES_XML_END_ELEMENT_TYPE:
+                ns_index, name_index = struct.unpack_from('<II', data,
+                                                          pos + header_size)
+                yield (RES_XML_END_ELEMENT_TYPE, depth,
+                       strings.get(name_index), None)
+                depth -= 1
+
+            elif chunk_type == RES_XML_START_NAMESPACE_TYPE:
+                prefix, uri = struct.unpack_from('<II', data,
+                                                 pos + header_size)
+                yield (RES_XML_START_NAMESPACE_TYPE, depth,
+                       strings.get(prefix), strings.get(uri))
+
+            elif chunk_type == RES_XML_CDATA_TYPE:
+                text = struct.unpack_from('<I', data, pos + header_size)[0]
+                yield RES_XML_CDATA_TYPE, depth, None, strings.get(text)
+
+            pos += chunk_size
+
+    except (struct.error, IndexError):
+        raise ApkFileException("Binary XML is malformed at %d!" % pos)
+
+def iterStartElements(data):
+
+    """Yield (depth, name, attributes) for each element of binary XML"""
+
+    for event, depth, name, value in iterXmlEvents(data):
+        if event == RES_XML_START_ELEMENT_TYPE:
+            yield depth, name, value
+
+def formatValue(attribute):
+
+    """Format an attribute value the way AXMLPrinter2 does"""
+
+    value_type = attribute.value_type
+    data = attribute.data
+
+    if value_type == TYPE_STRING:
+        return attribute.raw_value or u""
+    elif value_type == TYPE_ATTRIBUTE or value_type == TYPE_REFERENCE:
+        prefix = u"?" if value_type == TYPE_ATTRIBUTE else u"@"
+        if data >> 24 == 1:
+            prefix += u"android:"
+        return u"%s%08X" % (prefix, data)
+    elif value_type == TYPE_FLOAT:
+        return unicode(struct.unpack('<f', struct.pack('<I', data))[0])
+    elif value_type == TYPE_INT_HEX:
+        return u"0x%08X" % data
+    elif value_type == TYPE_INT_BOOLEAN:
+        return u"true" if data != 0 else u"false"
+    elif TYPE_FIRST_COLOR_INT <= value_type <= TYPE_LAST_COLOR_INT:
+        return u"#%08X" % data
+    elif value_type == TYPE_INT_DEC:
+        return unicode(convertValue(value_type, data))
+    elif attribute.raw_value is not None:
+        return attribute.raw_value
+    else:
+        return u"<0x%X, type 0x%02X>" % (data, value_type)
+
+def decodeXml(data):
+
+    """Decode binary XML to text, in the style of AXMLPrinter2"""
+
+    lines = [u'<?xml version="1.0" encoding="utf-8"?>']
+    prefixes = dict()
+    pending = list()
+
+    for event, depth, name, value in iterXmlEvents(data):
+
+        if event == RES_XML_START_NAMESPACE_TYPE:
+            prefixes[value] = name
+            pending.append((name, value))
+
+        elif event == RES_XML_START_ELEMENT_TYPE:
+            parts = [name]
+
+            for attribute in value:
+                attr_name = attribute.name
+                if not attr_name:
+                    attr_name = u"attr_%08x" % attribute.resource_id
+
+                if attribute.namespace:
+                    # Undeclared namespaces still need a prefix.
+                    if attribute.namespace not in prefixes:
+                        prefix = u"ns%d" % len(prefixes)
+                        prefixes[attribute.namespace] = prefix
+                        pending.append((prefix, attribute.namespace))
+
+                    attr_name = u"%s:%s" % (prefixes[attribute.namespace],
+                                            attr_name)
+
+                parts.append(u"%s=%s" % (attr_name,
+                                         quoteattr(formatValue(attribute))))
+
+            for prefix, uri in pending:
+                parts.insert(1, u"xmlns:%s=%s" % (prefix, quoteattr(uri)))
+            pending = list()
+
+            lines.append(u"%s<%s>" % (u"\t" * (depth - 1), u" ".join(parts)))
+
+        elif event == RES_XML_END_ELEMENT_TYPE:
+            lines.append(u"%s</%s>" % (u"\t" * (depth - 1), name))
+
+        elif event == RES_XML_CDATA_TYPE:
+            lines.append(u"%s%s" % (u"\t" * depth, escape(value or u"")))
+
+    return u"\n".join(lines) + u"\n"
+
+#### Resources #########################################
+class ResourceTable(object):
+
+    """resources.arsc reader for resolving simple values"""
+
+    def __init__(self, data):
+
+        self._data = data
+        self._types = dict()
+        self.strings = None
+
+        try:
+            chunk_type, header_size, size = struct.unpack_from('<HHI',
+                                                               data, 0)
+            if chunk_type != RES_TABLE_TYPE:
+                raise ApkFileException("Not a resource table!")
+
+            pos = header_size
+            end = min(size, len(data))
+
+            while pos + 8 <= end:
+                chunk_type, header_size, chunk_size = struct.unpack_from(
+                                                        '<HHI', data, pos)
+                if chunk_size < 8:
+                    raise ApkFileException("Bad chunk size at %d!" % pos)
+
+                if chunk_type == RES_STRING_POOL_TYPE:
+                    self.strings = StringPool(data, pos)
+                elif chunk_type == RES_TABLE_PACKAGE_TYPE:
+                    self._readPackage(pos, header_size, chunk_size)
+
+                pos += chunk_size
+
+        except (struct.error, IndexError):
+            raise ApkFileException("Resource table is malformed!")
+
+    def _readPackage(self, pos, header_size, size):
+
+        data = self._data
+        package_id = struct.unpack_from('<I', data, pos + 8)[0]
+
+        end = pos + size
+        pos += header_size
+
+        while pos + 8 <= end:
+            chunk_type, header_size, chunk_size = struct.unpack_from('<HHI',
+                                                                    data, pos)
+            if chunk_size < 8:
+                break
+
+            if chunk_type == RES_TABLE_TYPE_TYPE:
+                (type_id, flags, reserved, entry_count,
+                 entries_start, config_size) = struct.unpack_from(
+                                                    '<BBHIII', data, pos + 8)
+
+                # The default configuration is all zeros after its size.
+                config = data[pos + 24:pos + 20 + config_size]
+                is_default = config.count('\x00') == len(config)
+
+                key = (package_id, type_id)
+                self._types.setdefault(key, list()).append(
+                        (not is_default, pos, header_size, flags, entry_count,
+                         entries_start))
+
+            pos += chunk_size
+
+    def _readEntry(self, type_chunk, entry_id):
+
+        (not_default, pos, header_size, flags, entry_count,
+         entries_start) = type_chunk
+
+        data = self._data
+        offsets = pos + header_size
+
+        if flags & TYPE_FLAG_SPARSE:
+            offset = None
+            for i in range(entry_count):
+                index, sparse_offset = struct.unpack_from('<HH', data,
+                                                          offsets + i * 4)
+                if index == entry_id:
+                    offset = sparse_offset * 4
+                    break
+            if offset is None:
+                return None
+
+        elif entry_id >= entry_count:
+            return None
+
+        elif flags & TYPE_FLAG_OFFSET16:
+            offset = struct.unpack_from('<H', data, offsets + entry_id * 2)[0]
+            if offset == 0xffff:
+                return None
+            offset *= 4
+
+        else:
+            offset = struct.unpack_from('<I', data, offsets + entry_id * 4)[0]
+            if offset == NO_ENTRY:
+                return None
+
+        entry = pos + entries_start + offset
+        entry_size, entry_flags = struct.unpack_from('<HH', data, entry)
+
+        if entry_flags & ENTRY_FLAG_COMPACT:
+            return entry_flags >> 8, struct.unpack_from('<I', data,
+                                                        entry + 4)[0]
+
+        # Bags (styles, arrays, ...) aren't simple values.
+        if entry_flags & ENTRY_FLAG_COMPLEX:
+            return None
+
+        value_type, value_data = struct.unpack_from('<BI', data,
+                                                    entry + entry_size + 3)
+        return value_type, value_data
+
+    def getValue(self, resource_id, depth=0):
+
+        """Resolve a resource ID to a Python value, or None"""
+
+        key = (resource_id >> 24, (resource_id >> 16) & 0xff)
+        entry_id = resource_id & 0xffff
+
+        # Default configuration first, like aapt.
+        for type_chunk in sorted(self._types.get(key, list())):
+
+            try:
+                value = self._readEntry(type_chunk, entry_id)
+            except (struct.error, IndexError):
+                value = None
+
+            if value is None:
+                continue
+
+            value_type, value_data = value
+
+            if value_type == TYPE_REFERENCE and depth < MAX_REFERENCE_DEPTH:
+                return self.getValue(value_data, depth + 1)
+            if value_type == TYPE_STRING and self.strings is not None:
+                return self.strings.get(value_data)
+
+            return convertValue(value_type, value_data)
+
+        return None
+# End resources
+
+#### Manifest ##########################################
+def convertValue(value_type, data):
+
+    """Convert a simple typed value"""
+
+    if value_type == TYPE_INT_BOOLEAN:
+        return data != 0
+    elif value_type == TYPE_INT_DEC or value_type == TYPE_INT_HEX:
+        return struct.unpack('<i', struct.pack('<I', data))[0]
+    else:
+        return None
+
+def getAttribute(attributes, name, resource_id, resources=None):
+
+    """Get the value of an android: attribute, resolving references"""
+
+    for attribute in attributes:
+
+        if not attribute.matches(name, resource_id):
+            continue
+
+        if attribute.value_type == TYPE_STRING:
+            return attribute.raw_value
+        elif attribute.value_type == TYPE_REFERENCE:
+            table = resources() if resources is not None else None
+            if table is None:
+                return None
+            return table.getValue(attribute.data)
+        elif attribute.value_type in (TYPE_INT_DEC, TYPE_INT_HEX,
+                                      TYPE_INT_BOOLEAN):
+            return convertValue(attribute.value_type, attribute.data)
+        else:
+            return attribute.raw_value
+
+    return None
+
+def parseManifestInfo(manifest_data, resources=None):
+
+    """Get version and security info from binary AndroidManifest.xml"""
+
+    # 'resources' is a callable returning a ResourceTable (or None), so the
+    # table is only read when a value actually references it.
+    info = {'package_name': None,
+            'version_code': None,
+            'version_name': None,
+            'min_sdk_version': None,
+            'target_sdk_version': None,
+            'shared_user_id': None,
+            'debuggable': None,
+            'allow_backup': None}
+
+    for depth, name, attributes in iterStartElements(manifest_data):
+
+        if depth == 1 and name == "manifest":
+            for attribute in attributes:
+                if attribute.name == "package" and not attribute.namespace:
+                    info['package_name'] = attribute.raw_value
+
+            info['version_code'] = getAttribute(attributes, "versionCode",
+                                                ATTR_VERSION_CODE, resources)
+            info['version_name'] = getAttribute(attributes, "versionName",
+                                                ATTR_VERSION_NAME, resources)
+            info['shared_user_id'] = getAttribute(attributes, "sharedUserId",
+                                                  ATTR_SHARED_USER_ID,
+                                                  resources)
+
+        elif depth == 2 and name == "uses-sdk":
+            info['min_sdk_version'] = getAttribute(attributes,
+                                                   "minSdkVersion",
+                                                   ATTR_MIN_SDK_VERSION,
+                                                   resources)
+            info['target_sdk_version'] = getAttribute(attributes,
+                                                      "targetSdkVersion",
+                                                      ATTR_TARGET_SDK_VERSION,
+                                                      resources)
+
+        elif depth == 2 and name == "application":
+            info['debuggable'] = getAttribute(attributes, "debuggable",
+                                              ATTR_DEBUGGABLE, resources)
+            info['allow_backup'] = getAttribute(attributes, "allowBackup",
+                                                ATTR_ALLOW_BACKUP, resources)
+
+            # Nothing we want comes after <application>.
+            break
+
+    return info
+
+# End manifest
+
+#### Signatures ########################################
+def readDer(data, offset, end=None):
+
+    """Read one DER element, returning (tag, content start, end)"""
+
+    if end is None:
+        end = len(data)
+
+    if offset + 2 > end:
+        raise ApkFileException("Truncated DER element at %d!" % offset)
+
+    tag = ord(data[offset])
+    if tag & 0x1f == 0x1f:
+        raise ApkFileException("Unsupported DER tag at %d!" % offset)
+
+    length = ord(data[offset + 1])
+    pos = offset + 2
+
+    if length & 0x80:
+        count = length & 0x7f
+
+        # Indefinite lengths are BER, not DER.
+        if count == 0 or count > 4:
+            raise ApkFileException("Unsupported DER length at %d!" % offset)
+        if pos + count > end:
+            raise ApkFileException("Truncated DER element at %d!" % offset)
+
+        length = 0
+        for i in range(count):
+            length = (length << 8) | ord(data[pos + i])
+        pos += count
+
+    if pos + length > end:
+        raise ApkFileException("Truncated DER element at %d!" % offset)
+
+    return tag, pos, pos + length
+
+def iterDer(data, start, end):
+
+    """Iterate the elements in a DER range as (tag, start, content, end)"""
+
+    pos = start
+    while pos < end:
+        tag, content, next_pos = readDer(data, pos, end)
+        yield tag, pos, content, next_pos
+        pos = next_pos
+
+def decodeOid(data):
+
+    """Decode the content of a DER OBJECT IDENTIFIER"""
+
+    if len(data) == 0:
+        raise ApkFileException("Empty OID!")
+
+    first = ord(data[0])
+    parts = [min(first / 40, 2), first - min(first / 40, 2) * 40]
+
+    value = 0
+    for char in data[1:]:
+        value = (value << 7) | (ord(char) & 0x7f)
+        if not ord(char) & 0x80:
+            parts.append(value)
+            value = 0
+
+    return ".".join([str(part) for part in parts])
+
+def escapeNameValue(value):
+
+    """Escape a UTF-8 attribute value the way OpenSSL's oneline format does"""
+
+    out = list()
+    quote = False
+    last = len(value) - 1
+
+    for i, char in enumerate(value):
+        if char in '"\\':
+            out.append("\\" + char)
+        elif (char in ',+<>;' or (char == '#' and i == 0)
+                or (char == ' ' and (i == 0 or i == last))):
+            # These are quoted rather than escaped.
+            quote = True
+            out.append(char)
+        elif ord(char) < 0x20 or ord(char) >= 0x7f:
+            out.append("\\%02X" % ord(char))
+        else:
+            out.append(char)
+
+    if quote:
+        return '"%s"' % "".join(out)
+    return "".join(out)
+
+def formatName(data, start, end):
+
+    """Format an X.509 Name as 'CN = x, O = y'"""
+
+    rdns = list()
+    for tag, _, content, rdn_end in iterDer(data, start, end):
+        if tag != DER_SET:
+            raise ApkFileException("Malformed X.509 name!")
+
+        entries = list()
+        for _, _, atv, atv_end in iterDer(data, content, rdn_end):
+            elements = list(iterDer(data, atv, atv_end))
+            if len(elements) != 2 or elements[0][0] != DER_OID:
+                raise ApkFileException("Malformed X.509 name!")
+
+            oid = decodeOid(data[elements[0][2]:elements[0][3]])
+            value_tag, value_start, value, value_end = elements[1]
+
+            if value_tag in X509_STRINGS:
+                text = escapeNameValue(data[value:value_end].decode(
+                        X509_STRINGS[value_tag], 'replace').encode('utf-8'))
+            else:
+                # Anything else is dumped as hex DER.
+                text = "#" + data[value_start:value_end].encode('hex').upper()
+
+            entries.append("%s = %s" % (X509_NAMES.get(oid, oid), text))
+
+        rdns.append(" + ".join(entries))
+
+    return ", ".join(rdns)
+
+def parseCertificate(cert):
+
+    """Get the subject and issuer of a DER X.509 certificate"""
+
+    tag, content, end = readDer(cert, 0)
+    if tag != DER_SEQUENCE:
+        raise ApkFileException("Certificate is not a SEQUENCE!")
+
+    tag, tbs, tbs_end = readDer(cert, content, end)
+    fields = list(iterDer(cert, tbs, tbs_end))
+
+    # The version is optional, and is the only [0] here.
+    if len(fields) > 0 and fields[0][0] == DER_CONTEXT_0:
+        fields = fields[1:]
+
+    # serialNumber, signature, issuer, validity, subject
+    if len(fields) < 5:
+        raise ApkFileException("Truncated TBSCertificate!")
+
+    issuer = fields[2]
+    subject = fields[4]
+
+    return {'subject': formatName(cert, subject[2], subject[3]),
+            'issuer': formatName(cert, issuer[2], issuer[3]),
+            'cert': cert}
+
+def getPkcs7Certificates(data):
+
+    """List the DER certificates in a PKCS#7 SignedData blob"""
+
+    tag, content, end = readDer(data, 0)
+    if tag != DER_SEQUENCE:
+        raise ApkFileException("PKCS#7 blob is not a SEQUENCE!")
+
+    fields = list(iterDer(data, content, end))
+    if (len(fields) < 2 or fields[0][0] != DER_OID
+            or decodeOid(data[fields[0][2]:fields[0][3]]) != OID_SIGNED_DATA):
+        raise ApkFileException("PKCS#7 blob is not SignedData!")
+
+    if fields[1][0] != DER_CONTEXT_0:
+        raise ApkFileException("PKCS#7 blob has no content!")
+
+    tag, signed, signed_end = readDer(data, fields[1][2], fields[1][3])
+    if tag != DER_SEQUENCE:
+        raise ApkFileException("Malformed PKCS#7 SignedData!")
+
+    # version, digestAlgorithms, contentInfo, [0] certificates, ...
+    for tag, _, certs, certs_end in iterDer(data, signed, signed_end):
+        if tag == DER_CONTEXT_0:
+            return [data[cert_start:cert_end] for _, cert_start, _, cert_end
+                                    in iterDer(data, certs, certs_end)]
+    return list()
+
+def readPrefixed(data, offset, end):
+
+    """Read a uint32 length-prefixed value, returning (start, end)"""
+
+    if offset + 4 > end:
+        raise ApkFileException("Truncated signing block value!")
+
+    length = struct.unpack_from("<I", data, offset)[0]
+    if offset + 4 + length > end:
+        raise ApkFileException("Truncated signing block value!")
+
+    return offset + 4, offset + 4 + length
+
+def iterPrefixed(data, start, end):
+
+    """Iterate a sequence of length-prefixed values as (start, end)"""
+
+    pos = start
+    while pos < end:
+        value_start, value_end = readPrefixed(data, pos, end)
+        yield value_start, value_end
+        pos = value_end
+
+def readSigningBlock(apk_file):
+
+    """Read the APK Signing Block pairs of an open file, keyed by ID"""
+
+    apk_file.seek(0, os.SEEK_END)
+    file_size = apk_file.tell()
+
+    # The EOCD comment is at most 64k.
+    tail_size = min(file_size, EOCD_SIZE + 0xffff)
+    apk_file.seek(file_size - tail_size)
+    tail = apk_file.read(tail_size)
+
+    eocd = tail.rfind(EOCD_MAGIC)
+    if eocd < 0 or eocd + EOCD_SIZE > len(tail):
+        raise ApkFileException("No end of central directory record!")
+
+    cd_offset = struct.unpack_from("<I", tail, eocd + 16)[0]
+    if cd_offset < 24:
+        return dict()
+
+    apk_file.seek(cd_offset - 24)
+    footer = apk_file.read(24)
+    if len(footer) != 24 or footer[8:] != SIG_BLOCK_MAGIC:
+        return dict()
+
+    block_size = struct.unpack_from("<Q", footer, 0)[0]
+    block_start = cd_offset - block_size - 8
+    if block_size < 24 or block_start < 0:
+        raise ApkFileException("Malformed APK Signing Block!")
+
+    apk_file.seek(block_start)
+    block = apk_file.read(block_size + 8)
+    if struct.unpack_from("<Q", block, 0)[0] != block_size:
+        raise ApkFileException("Malformed APK Signing Block!")
+
+    pairs = dict()
+    pos = 8
+    end = len(block) - 24
+    while pos + 12 <= end:
+        pair_size, pair_id = struct.unpack_from("<QI", block, pos)
+        if pair_size < 4 or pos + 8 + pair_size > end:
+            raise ApkFileException("Malformed APK Signing Block pair!")
+
+        pairs[pair_id] = block[pos + 12:pos + 8 + pair_size]
+        pos += 8 + pair_size
+
+    return pairs
+
+def getSchemeCertificates(value):
+
+    """List the first signer's DER certificates in a v2/v3 block value"""
+
+    signers = readPrefixed(value, 0, len(value))
+    for signer_start, signer_end in iterPrefixed(value, *signers):
+
+        # signed data: digests, certificates, ...
+        signed = readPrefixed(value, signer_start, signer_end)
+        digests = readPrefixed(value, signed[0], signed[1])
+        certs = readPrefixed(value, digests[1], signed[1])
+
+        return [value[cert_start:cert_end] for cert_start, cert_end
+                                    in iterPrefixed(value, *certs)]
+    return list()
+
+def getCachedSignature(data, parse):
+
+    """Parse a signature blob once per distinct content"""
+
+    key = hashlib.sha1(data).hexdigest()
+
+    with _SIGNATURES_LOCK:
+        if key in _SIGNATURES:
+            return _SIGNATURES[key]
+
+    # Most ROMs are signed by a handful of keys, so this rarely grows.
+    info = parse(data)
+
+    with _SIGNATURES_LOCK:
+        if len(_SIGNATURES) >= MAX_CACHED_SIGNATURES:
+            _SIGNATURES.clear()
+        _SIGNATURES[key] = info
+
+    return info
+
+def parseV1Signature(data):
+
+    """Get the signer of a META-INF signature block file"""
+
+    certs = getPkcs7Certificates(data)
+    if len(certs) == 0:
+        return None
+
+    info = parseCertificate(certs[0])
+    info['scheme'] = 'v1'
+    return info
+
+def parseSchemeSignature(data):
+
+    """Get the signer of a v3 or v2 APK Signing Block value"""
+
+    scheme, value = data[:2], data[2:]
+
+    certs = getSchemeCertificates(value)
+    if len(certs) == 0:
+        return None
+
+    info = parseCertificate(certs[0])
+    info['scheme'] = scheme
+    return info
+# End signatures
+
+#### Native libraries ##################################
+def readElfInfo(elf_file):
+
+    """Read the arch, SONAME and needed libraries of an open ELF file"""
+
+    elf_file.seek(0)
+    ident = elf_file.read(16)
+
+    if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+        return None
+
+    elf_class = ord(ident[4])
+    endian = {ELF_DATA_LSB: "<", ELF_DATA_MSB: ">"}.get(ord(ident[5]))
+
+    if elf_class not in (ELF_CLASS_32, ELF_CLASS_64) or endian is None:
+        raise ApkFileException("Unsupported ELF class or data encoding!")
+
+    # e_type, e_machine, e_version, e_entry, e_phoff, e_shoff, e_flags,
+    # e_ehsize, e_phentsize, e_phnum, ...
+    if elf_class == ELF_CLASS_32:
+        header_format = endian + "HHIIIIIHHH"
+        phdr_format = endian + "IIIIIIII"
+        dyn_format = endian + "iI"
+    else:
+        header_format = endian + "HHIQQQIHHH"
+        phdr_format = endian + "IIQQQQQQ"
+        dyn_format = endian + "qQ"
+
+    header = struct.unpack(header_format,
+                           elf_file.read(struct.calcsize(header_format)))
+    machine, phoff, phentsize, phnum = (header[1], header[4], header[8],
+                                        header[9])
+
+    info = {'arch': ELF_MACHINES.get((elf_class, machine),
+                                     "machine-%d" % machine),
+            'soname': None,
+            'needed': list()}
+
+    # Strings are found through the segments, which (unlike the
+    # sections) stripped libraries always keep.
+    loads = list()
+    dynamic = None
+
+    if phnum != 0 and phentsize < struct.calcsize(phdr_format):
+        raise ApkFileException("Malformed ELF program header table!")
+
+    elf_file.seek(phoff)
+    table = elf_file.read(phentsize * phnum)
+
+    for i in range(phnum):
+        phdr = struct.unpack_from(phdr_format, table, i * phentsize)
+        if elf_class == ELF_CLASS_32:
+            p_type, offset, vaddr, filesz = phdr[0], phdr[1], phdr[2], phdr[4]
+        else:
+            p_type, offset, vaddr, filesz = phdr[0], phdr[2], phdr[3], phdr[5]
+
+        if p_type == PT_LOAD:
+            loads.append((vaddr, offset, filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic = (offset, filesz)
+
+    if dynamic is None:
+        return info
+
+    elf_file.seek(dynamic[0])
+    entries = elf_file.read(dynamic[1])
+    dyn_size = struct.calcsize(dyn_format)
+
+    needed = list()
+    soname = None
+    strtab = None
+    strsz = 0
+
+    for pos in range(0, len(entries) - dyn_size + 1, dyn_size):
+        tag, value = struct.unpack_from(dyn_format, entries, pos)
+        if tag == DT_NULL:
+            break
+        elif tag == DT_NEEDED:
+            needed.append(value)
+        elif tag == DT_SONAME:
+            soname = value
+        elif tag == DT_STRTAB:
+            strtab = value
+        elif tag == DT_STRSZ:
+            strsz = value
+
+    # DT_STRTAB is an address; find the file offset that loads there.
+    strings = None
+    for vaddr, offset, filesz in loads:
+        if strtab is not None and vaddr <= strtab < vaddr + filesz:
+            elf_file.seek(offset + strtab - vaddr)
+            strings = elf_file.read(min(strsz, MAX_ELF_STRTAB_SIZE))
+            break
+
+    if strings is None:
+        return info
+
+    def getString(index):
+
+        end = strings.find("\0", index)
+        return strings[index:end if end >= 0 else len(strings)]
+
+    if soname is not None:
+        info['soname'] = getString(soname)
+    info['needed'] = [getString(index) for index in needed]
+
+    return info
+
+def getNativeLibInfo(lib_path):
+
+    """Get the size, MD5 and ELF details of a native library"""
+
+    md5 = hashlib.md5()
+    info = None
+
+    try:
+        with open(lib_path, 'rb') as lib_file:
+            try:
+                info = readElfInfo(lib_file)
+            except (struct.error, ApkFileException):
+                # Still worth recording, just without the details.
+                info = None
+
+            lib_file.seek(0)
+            for chunk in iter(lambda: lib_file.read(COPY_BUFFER_SIZE), ""):
+                md5.update(chunk)
+
+            size = lib_file.tell()
+
+    except IOError as err:
+        raise ApkFileException("Unable to read '%s': %s" % (lib_path, err))
+
+    if info is None:
+        info = {'arch': None, 'soname': None, 'needed': list()}
+
+    info['size'] = size
+    info['md5'] = md5.hexdigest()
+
+    return info
+# End native libraries
+
+#### Zip access ########################################
+class ApkFile(object):
+
+    """An APK opened once, with its central directory kept in memory"""
+
+    def __init__(self, apk_path):
+
+        try:
+            self._zip = zipfile.ZipFile(apk_path)
+        except (IOError, zipfile.BadZipfile) as err:
+            raise ApkFileException("Unable to open '%s': %s" % (apk_path, err))
+
+        self.path = apk_path
+        self._names = [info.filename for info in self._zip.infolist()]
+        self._entries = dict((info.filename, info)
+                                 for info in self._zip.infolist())
+
+    def close(self):
+
+        """Close the archive"""
+
+        self._zip.close()
+
+    def hasEntry(self, name):
+
+        """Check if the APK contains an entry"""
+
+        return name in self._entries
+
+    def getEntries(self, pattern=None):
+
+        """List entries matching a glob, in central directory order"""
+
+        if pattern is None:
+            return list(self._names)
+
+        return [name for name in self._names
+                    if fnmatch.fnmatchcase(name, pattern)]
+
+    def getEntrySize(self, name):
+
+        """Get the uncompressed size of an entry"""
+
+        try:
+            return self._entries[name].file_size
+        except KeyError:
+            raise ApkFileException("No entry '%s' in '%s'!"
+                                        % (name, self.path))
+
+    def open(self, name):
+
+        """Open an entry as a stream, without extracting it"""
+
+        if name not in self._entries:
+            raise ApkFileException("No entry '%s' in '%s'!"
+                                        % (name, self.path))
+        try:
+            # Opening by name re-opens the archive for every stream, so
+            # several threads can read the same handle at once.
+            return self._zip.open(self._entries[name])
+        except (IOError, RuntimeError, zipfile.BadZipfile) as err:
+            raise ApkFileException("Unable to read '%s' from '%s': %s"
+                                        % (name, self.path, err))
+
+    def read(self, name):
+
+        """Read an entry into memory"""
+
+        stream = self.open(name)
+        try:
+            return stream.read()
+        except (IOError, zipfile.BadZipfile) as err:
+            raise ApkFileException("Unable to read '%s' from '%s': %s"
+                                        % (name, self.path, err))
+        finally:
+            stream.close()
+
+    def copyEntry(self, name, out_path):
+
+        """Stream an entry to a file"""
+
+        out_dir = os.path.dirname(out_path)
+        stream = self.open(name)
+        try:
+            if out_dir != "" and not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            with open(out_path, 'wb') as out_file:
+                shutil.copyfileobj(stream, out_file, COPY_BUFFER_SIZE)
+        except (IOError, OSError, zipfile.BadZipfile) as err:
+            raise ApkFileException("Unable to extract '%s' from '%s': %s"
+                                        % (name, self.path, err))
+        finally:
+            stream.close()
+
+    def extractEntries(self, prefix, out_dir):
+
+        """Extract every entry under a prefix (e.g. 'lib/') to a directory"""
+
+        count = 0
+        for name in self._names:
+            if not name.startswith(prefix) or name.endswith('/'):
+                continue
+
+            out_path = safeJoin(out_dir, name)
+            if out_path is None:
+                raise ApkFileException("Refusing to extract '%s' from '%s'!"
+                                            % (name, self.path))
+            self.copyEntry(name, out_path)
+            count += 1
+
+        return count
+
+    def getDexEntries(self):
+
+        """List the classes[N].dex entries of an APK, in load order"""
+
+        entries = list()
+        for name in self._names:
+            match = DEX_ENTRY_RE.match(name)
+            if match is not None:
+                # classes.dex is the first, then classes2.dex and up.
+                entries.append((int(match.group(1) or 1), name))
+
+        return [name for index, name in sorted(entries)]
+
+    def getSignatureEntries(self):
+
+        """List the v1 signature block files (META-INF/*.RSA|DSA|EC)"""
+
+        entries = list()
+        for pattern in SIGNATURE_PATTERNS:
+            entries.extend(self.getEntries(pattern))
+        return entries
+
+    def getSigningBlock(self):
+
+        """Read the APK Signing Block (v2+) pairs, keyed by ID"""
+
+        try:
+            with open(self.path, 'rb') as apk_file:
+                return readSigningBlock(apk_file)
+        except (IOError, struct.error) as err:
+            raise ApkFileException("Unable to read signing block of '%s': %s"
+                                        % (self.path, err))
+
+    def getSignatureInfo(self):
+
+        """Get the signer's subject, issuer and DER certificate"""
+
+        # v1 first, so the result matches what older releases recorded.
+        for name in self.getSignatureEntries():
+            info = getCachedSignature(self.read(name), parseV1Signature)
+            if info is not None:
+                return info
+
+        pairs = self.getSigningBlock()
+        for scheme, pair_id in (("v3", SIG_BLOCK_V3_ID),
+                                ("v2", SIG_BLOCK_V2_ID)):
+            if pair_id in pairs:
+                info = getCachedSignature(scheme + pairs[pair_id],
+                                          parseSchemeSignature)
+                if info is not None:
+                    return info
+
+        return None
+
+    def getManifestData(self):
+
+        """Read the binary AndroidManifest.xml"""
+
+        if MANIFEST_NAME not in self._entries:
+            raise ApkFileException("No manifest in '%s'!" % self.path)
+
+        return self.read(MANIFEST_NAME)
+
+    def getManifestInfo(self):
+
+        """Read version and security info straight from the APK"""
+
+        table = list()
+
+        def resources():
+
+            # resources.arsc is only read if the manifest points into it.
+            if len(table) == 0:
+                try:
+                    table.append(ResourceTable(self.read(RESOURCES_NAME)))
+                except ApkFileException:
+                    table.append(None)
+            return table[0]
+
+        return parseManifestInfo(self.getManifestData(), resources)
+
+    def getManifestXml(self):
+
+        """Decode the APK's AndroidManifest.xml to text"""
+
+        return decodeXml(self.getManifestData())
+
+def safeJoin(out_dir, name):
+
+    """Join an entry name to a directory, refusing to leave it"""
+
+    out_dir = os.path.abspath(out_dir)
+    out_path = os.path.normpath(os.path.join(out_dir, name))
+
+    if not out_path.startswith(out_dir + os.sep):
+        return None
+    return out_path
+
+def openApk(apk_path):
+
+    """Get the shared handle for an APK, opening it if needed"""
+
+    try:
+        stat = os.stat(apk_path)
+    except OSError as err:
+        raise ApkFileException("Unable to open '%s': %s" % (apk_path, err))
+
+    key = os.path.abspath(apk_path)
+    stamp = (stat.st_size, stat.st_mtime)
+
+    with _HANDLES_LOCK:
+        cached = _HANDLES.pop(key, None)
+
+        # A re-pulled APK gets a new handle.
+        if cached is not None and cached[0] == stamp:
+            _HANDLES[key] = cached
+            return cached[1]
+
+        apk = ApkFile(apk_path)
+        _HANDLES[key] = (stamp, apk)
+
+        # Evicted handles are not closed here, since another stage may
+        # still be streaming from them; they close once released.
+        while len(_HANDLES) > MAX_OPEN_HANDLES:
+            _HANDLES.popitem(last=False)
+
+        return apk
+
+def closeApks():
+
+    """Drop every shared handle"""
+
+    with _HANDLES_LOCK:
+        _HANDLES.clear()
+
+def getManifestInfo(apk_path):
+
+    """Read version and security info straight from an APK"""
+
+    return openApk(apk_path).getManifestInfo()
+
+def getManifestXml(apk_path):
+
+    """Decode an APK's AndroidManifest.xml to text"""
+
+    return openApk(apk_path).getManifestXml()
+
+def getSignatureInfo(apk_path):
+
+    """Get the signer's subject, issuer and DER certificate"""
+
+    return openApk(apk_path).getSignatureInfo()
+
+def getDexEntries(apk_path):
+
+    """List the classes[N].dex entries of an APK, in load order"""
+
+    return openApk(apk_path).getDexEntries()
+
+def extractEntries(apk_path, prefix, out_dir):
+
+    """Extract every entry under a prefix (e.g. 'lib/') to a directory"""
+
+    return openApk(apk_path).extractEntries(prefix, out_dir)
+# End zip access
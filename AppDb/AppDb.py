@@ -22,6 +22,7 @@ import dtf.logging as log
 import dtf.globals as globals
 import dtf.properties as prop
 import base64
+import hashlib
 
 _TAG = "AppDb"
 
@@ -39,6 +40,13 @@ PROTECTION_FLAG_DEVELOPMENT = 0x20
 
 PROTECTION_MASK_BASE = 0x0f
 
+# Component table -> (intent filter link table, component column)
+INTENT_FILTER_LINKS = {'activities': ('intent_filter_to_activity',
+                                      'activity_id'),
+                       'services': ('intent_filter_to_service', 'service_id'),
+                       'receivers': ('intent_filter_to_receiver',
+                                     'receiver_id')}
+
 # Check if we can the api data
 def isAOSPDataInstalled():
 
@@ -57,6 +65,28 @@ def isGoogleApp(package_name):
     else:
         return False
 
+# Components store True/False/None as text.
+def parseFlag(value):
+
+    if value == "None":
+        return None
+    elif value == "False":
+        return False
+    elif value == "True":
+        return True
+    else:
+        log.e(_TAG, "Unknown export value :  %s" % value)
+        return value
+
+# Hash values the same way in every database.
+def getFingerprint(*values):
+
+    text = u'\0'.join(value if isinstance(value, unicode)
+                            else unicode(str(value), 'utf-8')
+                                for value in values)
+
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
 # Exceptions
 class AppDbException(Exception):
 
@@ -402,6 +432,34 @@ class IntentData(object):
         else:
             return tmp
 
+# Shared library class
+class SharedLibrary(object):
+
+    _id = 0
+    application_id = 0
+    name = ""
+    abi = None
+    arch = None
+    soname = None
+    needed = None
+    size = 0
+    md5 = None
+
+    def __init__(self, name, abi, arch, soname, needed, size, md5,
+                 application_id=0, id=None):
+
+        self.name = name
+        self.abi = abi
+        self.arch = arch
+        self.soname = soname
+        self.needed = needed
+        self.size = size
+        self.md5 = md5
+        self.application_id = application_id
+
+        if id is not None:
+            self._id = id
+
 # Signature class
 class Signature(object):
 
@@ -432,8 +490,9 @@ class AppDb(object):
 
     db_path = None
     app_db = None
+    in_transaction = False
 
-    def __init__(self, db_path, safe=False):
+    def __init__(self, db_path, safe=False, read_only=False):
 
         # Make sure the DB exists, don't create it.
         if safe and not isfile(db_path):
@@ -442,10 +501,79 @@ class AppDb(object):
         self.db_path = db_path
         self.app_db = sqlite3.connect(db_path)
 
+        # For readers sharing a database, e.g. worker processes.
+        if read_only:
+            self.app_db.execute('PRAGMA query_only=ON')
+
 
     def commit(self):
+
+        # Inside beginTransaction(), everything waits for endTransaction().
+        if self.in_transaction:
+            return None
+
         return self.app_db.commit()
 
+    def close(self):
+        return self.app_db.close()
+
+#### Transaction Methods ###############################
+    def beginTransaction(self):
+
+        """Start one explicit transaction for a batch of writes"""
+
+        # pysqlite commits before any statement it doesn't know, such as
+        # SAVEPOINT, so take it out of transaction handling for now.
+        self.app_db.commit()
+        self.app_db.isolation_level = None
+        self.app_db.execute('BEGIN')
+        self.in_transaction = True
+
+        return 0
+
+    def endTransaction(self):
+
+        """Commit the explicit transaction"""
+
+        self.app_db.execute('COMMIT')
+        self.in_transaction = False
+        self.app_db.isolation_level = ''
+
+        return 0
+
+    def abortTransaction(self):
+
+        """Roll back the explicit transaction"""
+
+        self.app_db.execute('ROLLBACK')
+        self.in_transaction = False
+        self.app_db.isolation_level = ''
+
+        return 0
+
+    def savepoint(self, name):
+
+        """Mark a point to roll back to, within a transaction"""
+
+        self.app_db.execute('SAVEPOINT %s' % name)
+        return 0
+
+    def releaseSavepoint(self, name):
+
+        """Keep everything since a savepoint"""
+
+        self.app_db.execute('RELEASE SAVEPOINT %s' % name)
+        return 0
+
+    def rollbackSavepoint(self, name):
+
+        """Undo everything since a savepoint, and drop it"""
+
+        self.app_db.execute('ROLLBACK TO SAVEPOINT %s' % name)
+        self.app_db.execute('RELEASE SAVEPOINT %s' % name)
+        return 0
+    # End Transaction
+
 #### Table Creation Methods ############################
     def createTables(self):
 
@@ -523,6 +651,10 @@ class AppDb(object):
             log.e(_TAG, "failed to create app uses signatures table!")
             return -1
 
+        if (not self.createPermissionUsageTable()):
+            log.e(_TAG, "failed to create permission usage table!")
+            return -1
+
         return 0
 
     def createAppsTable(self):
@@ -545,10 +677,41 @@ class AppDb(object):
                'successfully_unpacked INTEGER DEFAULT 0, '
                'shared_user_id TEXT, '
                'shared_user_label TEXT, '
-               'allow_backup INTEGER)')
+               'allow_backup INTEGER, '
+               'apk_size INTEGER DEFAULT 0, '
+               'apk_md5 TEXT, '
+               'dex_count INTEGER DEFAULT 0, '
+               'manifest_digest TEXT, '
+               'libs_digest TEXT, '
+               'signature_digest TEXT)')
 
         return self.app_db.execute(sql)
 
+    def upgradeAppsTable(self):
+
+        """Add columns missing from an older 'apps' table"""
+
+        columns = [row[1] for row in
+                        self.app_db.execute('PRAGMA table_info(apps)')]
+
+        if 'apk_size' not in columns:
+            self.app_db.execute('ALTER TABLE apps '
+                                'ADD COLUMN apk_size INTEGER DEFAULT 0')
+        if 'apk_md5' not in columns:
+            self.app_db.execute('ALTER TABLE apps '
+                                'ADD COLUMN apk_md5 TEXT')
+        if 'dex_count' not in columns:
+            self.app_db.execute('ALTER TABLE apps '
+                                'ADD COLUMN dex_count INTEGER DEFAULT 0')
+
+        for column in ['manifest_digest', 'libs_digest', 'signature_digest']:
+            if column not in columns:
+                self.app_db.execute('ALTER TABLE apps '
+                                    'ADD COLUMN %s TEXT' % column)
+
+        self.app_db.commit()
+        return 0
+
     def createPermissionGroupsTable(self):
 
         sql = ('CREATE TABLE IF NOT EXISTS permission_groups'
@@ -674,11 +837,141 @@ class AppDb(object):
                '('
                'id INTEGER PRIMARY KEY AUTOINCREMENT,'
                'name TEXT NOT NULL,'
+               'abi TEXT,'
+               'arch TEXT,'
+               'soname TEXT,'
+               'needed TEXT,'
+               'size INTEGER,'
+               'md5 TEXT,'
                'application_id INTEGER,'
                'FOREIGN KEY(application_id) REFERENCES apps(id)'
                ')')
 
-        return self.app_db.execute(sql)
+        rtn = self.app_db.execute(sql)
+        self.createSharedLibrariesIndexes()
+
+        return rtn
+
+    def createSharedLibrariesIndexes(self):
+
+        """Index libraries by SONAME and MD5, for lookups across apps"""
+
+        self.app_db.execute('CREATE INDEX IF NOT EXISTS '
+                            'shared_libraries_soname '
+                            'ON shared_libraries(soname)')
+        self.app_db.execute('CREATE INDEX IF NOT EXISTS '
+                            'shared_libraries_md5 '
+                            'ON shared_libraries(md5)')
+        return 0
+
+    def upgradeSharedLibrariesTable(self):
+
+        """Add columns missing from an older 'shared_libraries' table"""
+
+        columns = [row[1] for row in
+                    self.app_db.execute('PRAGMA table_info(shared_libraries)')]
+
+        for column, column_type in [('abi', 'TEXT'), ('arch', 'TEXT'),
+                                    ('soname', 'TEXT'), ('needed', 'TEXT'),
+                                    ('size', 'INTEGER'), ('md5', 'TEXT')]:
+            if column not in columns:
+                self.app_db.execute('ALTER TABLE shared_libraries '
+                                    'ADD COLUMN %s %s' % (column, column_type))
+
+        self.createSharedLibrariesIndexes()
+        self.app_db.commit()
+        return 0
+
+    def hasSharedLibraryDetails(self):
+
+        """Check if libraries were processed with their ELF details"""
+
+        columns = [row[1] for row in
+                    self.app_db.execute('PRAGMA table_info(shared_libraries)')]
+
+        return 'md5' in columns
+
+    def createPermissionUsageTable(self):
+
+        """Which components (and apps) use each permission, and how"""
+
+        # Filled from the other tables by buildPermissionUsage().
+        sql = ('CREATE TABLE IF NOT EXISTS permission_usage'
+               '('
+               'permission_id INTEGER,'
+               'role TEXT,'
+               'component_type TEXT,'
+               'component_id INTEGER,'
+               'component_name TEXT,'
+               'application_id INTEGER,'
+               'FOREIGN KEY(permission_id) REFERENCES permissions(id),'
+               'FOREIGN KEY(application_id) REFERENCES apps(id)'
+               ')')
+
+        rtn = self.app_db.execute(sql)
+
+        self.app_db.execute('CREATE INDEX IF NOT EXISTS '
+                            'permission_usage_permission '
+                            'ON permission_usage(permission_id, role)')
+        self.app_db.execute('CREATE INDEX IF NOT EXISTS '
+                            'permissions_name '
+                            'ON permissions(name)')
+        return rtn
+
+    def buildPermissionUsage(self):
+
+        """Rebuild the permission usage index from the component tables"""
+
+        self.createPermissionUsageTable()
+        self.app_db.execute('DELETE FROM permission_usage')
+
+        # Components without a permission are guarded by the app's. A
+        # provider's read/write permissions fall back to that permission.
+        guard = ('(CASE WHEN c.permission!=0 THEN c.permission '
+                 'ELSE a.permission END)')
+
+        selects = ['SELECT %s AS permission_id, \'guard\', \'%s\', '
+                   'c.id, c.name, c.application_id '
+                   'FROM %s c JOIN apps a ON a.id=c.application_id'
+                        % (guard, table, table)
+                            for table in ('activities', 'services',
+                                          'receivers')]
+
+        for role in ('read', 'write'):
+            selects.append('SELECT (CASE WHEN c.%s_permission!=0 '
+                           'THEN c.%s_permission ELSE %s END) '
+                           'AS permission_id, '
+                           '\'%s\', \'providers\', c.id, c.name, '
+                           'c.application_id '
+                           'FROM providers c '
+                           'JOIN apps a ON a.id=c.application_id'
+                                % (role, role, guard, role))
+
+        selects.append('SELECT permission_id, \'uses\', NULL, NULL, NULL, '
+                       'application_id '
+                       'FROM app_uses_permissions')
+
+        sql = ('INSERT INTO permission_usage(permission_id, role, '
+               'component_type, component_id, component_name, '
+               'application_id) '
+               'SELECT * FROM (%s) '
+               'WHERE permission_id!=0' % ' UNION ALL '.join(selects))
+
+        self.app_db.execute(sql)
+        return 0
+
+    def upgradePermissionUsageTable(self):
+
+        """Build the permission usage index for older databases"""
+
+        exists = self.app_db.execute('SELECT name FROM sqlite_master '
+                                     "WHERE type='table' "
+                                     "AND name='permission_usage'").fetchone()
+        if exists is None:
+            self.buildPermissionUsage()
+            self.app_db.commit()
+
+        return 0
 
     def createProtectedBroadcastsTable(self):
 
@@ -831,10 +1124,99 @@ class AppDb(object):
         self.app_db.execute('''DROP TABLE IF EXISTS intent_datas''')
         self.app_db.execute('''DROP TABLE IF EXISTS signatures''')
         self.app_db.execute('''DROP TABLE IF EXISTS app_uses_signatures''')
+        self.app_db.execute('''DROP TABLE IF EXISTS permission_usage''')
 
     # End Table Deletion
 
+#### Table Deletion Methods (per app) ###################
+    def deleteApp(self, application_id):
+
+        """Remove an application and everything it owns"""
+
+        self.deleteAppComponents(application_id)
+        self.app_db.execute('DELETE FROM apps WHERE id=?', (application_id,))
+
+        return 0
+
+    def deleteAppComponents(self, application_id):
+
+        """Remove the processed (non-apps) rows of an application"""
+
+        # Nothing to do if `process` was never run.
+        if not self.isProcessed():
+            return 0
+
+        self._deleteIntentFilters('intent_filter_to_activity', 'activity_id',
+                                  'activities', application_id)
+        self._deleteIntentFilters('intent_filter_to_service', 'service_id',
+                                  'services', application_id)
+        self._deleteIntentFilters('intent_filter_to_receiver', 'receiver_id',
+                                  'receivers', application_id)
+
+        for table in ['activities', 'services', 'providers', 'receivers',
+                      'permissions', 'permission_groups',
+                      'protected_broadcasts', 'shared_libraries',
+                      'app_uses_permissions', 'app_uses_signatures']:
+
+            self.app_db.execute('DELETE FROM %s WHERE application_id=?'
+                                                % table, (application_id,))
+
+        self.resetProcessedColumns(application_id)
+        return 0
+
+    def resetProcessedColumns(self, application_id=None):
+
+        """Clear the app columns `process` fills in, for one or all apps"""
+
+        sql = ('UPDATE apps '
+               'SET permission=0, has_native=0, debuggable=NULL, '
+               'allow_backup=NULL, shared_user_id=NULL, '
+               'shared_user_label=NULL')
+
+        if application_id is None:
+            return self.app_db.execute(sql)
+
+        return self.app_db.execute(sql + ' WHERE id=?', (application_id,))
+
+    def deleteUnusedSignatures(self):
+
+        """Remove signatures no application links to anymore"""
+
+        return self.app_db.execute('DELETE FROM signatures WHERE id NOT IN '
+                                   '(SELECT signature_id '
+                                   'FROM app_uses_signatures)')
+
+    def _deleteIntentFilters(self, join_table, id_name, component_table,
+                             application_id):
+
+        """Remove intent filters of one component type for an app"""
+
+        filter_ids = ('SELECT iftx.intent_filter_id FROM %s iftx '
+                      'JOIN %s x ON iftx.%s=x.id '
+                      'WHERE x.application_id=?'
+                      % (join_table, component_table, id_name))
+
+        for table in ['intent_actions', 'intent_categories', 'intent_datas']:
+            self.app_db.execute('DELETE FROM %s WHERE intent_filter_id IN (%s)'
+                                % (table, filter_ids), (application_id,))
+
+        self.app_db.execute('DELETE FROM intent_filters WHERE id IN (%s)'
+                            % filter_ids, (application_id,))
+
+        self.app_db.execute('DELETE FROM %s WHERE %s IN '
+                            '(SELECT id FROM %s WHERE application_id=?)'
+                            % (join_table, id_name, component_table),
+                            (application_id,))
+    # End Table Deletion (per app)
+
 #### Private Methods #####################################
+    def _hasTable(self, table_name):
+
+        sql = ("SELECT name FROM sqlite_master "
+               "WHERE type='table' AND name=?")
+
+        return self.app_db.execute(sql, (table_name,)).fetchone() is not None
+
     def _getLastId(self, table_name):
 
         sql = ("SELECT seq FROM SQLITE_SEQUENCE WHERE name='%s'" % table_name)
@@ -855,10 +1237,33 @@ class AppDb(object):
         sql = ('INSERT INTO apps(package_name, project_name) '
                'VALUES (?, ?)')
 
+        # Callers commit once they've added the whole batch.
         self.app_db.execute(sql, (package_name, project_name))
-        self.app_db.commit()
         return 0
 
+    def resetApp(self, application_id, package_name):
+
+        """Mark an application as needing a new pull and unpack"""
+
+        sql = ('UPDATE apps '
+               'SET package_name=?, decoded_path=NULL, successfully_pulled=0, '
+               'successfully_unpacked=0, apk_size=0, apk_md5=NULL '
+               'WHERE id=?')
+
+        return self.app_db.execute(sql, (package_name, application_id))
+
+    def setPulledApp(self, project_name, pulled_info):
+
+        """Record a pull done into another DB, as getPulledApps() gave it"""
+
+        sql = ('UPDATE apps '
+               'SET min_sdk_version=?, target_sdk_version=?, '
+               'version_name=?, version_code=?, apk_size=?, apk_md5=?, '
+               'successfully_pulled=1 '
+               'WHERE project_name=?')
+
+        return self.app_db.execute(sql, tuple(pulled_info) + (project_name,))
+
     def addPermissionGroup(self, permission_group):
 
         name = permission_group.name
@@ -1017,6 +1422,19 @@ class AppDb(object):
 
         return self.app_db.execute(sql)
 
+    def addSharedLibraries(self, application_id, libraries):
+
+        """Add every native library of an app in one statement"""
+
+        sql = ('INSERT INTO shared_libraries(name, abi, arch, soname, needed, '
+               'size, md5, application_id) '
+               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+        return self.app_db.executemany(sql,
+                    [(lib.name, lib.abi, lib.arch, lib.soname,
+                      ";".join(lib.needed), lib.size, lib.md5, application_id)
+                        for lib in libraries])
+
     def addProtectedBroadcast(self, name, application_id):
 
         sql = ('INSERT INTO protected_broadcasts(name, application_id) '
@@ -1165,6 +1583,12 @@ class AppDb(object):
     # End Table Modification
 
 #### Table Querying Methods ############################
+    def isProcessed(self):
+
+        """Check if `process` has populated this database"""
+
+        return self._hasTable('activities')
+
     def getApps(self, dont_resolve=False):
 
         app_list = list()
@@ -1231,6 +1655,42 @@ class AppDb(object):
             app_list.append((package_name, project_name))
         return app_list
 
+    def getPulledApps(self):
+
+        """Return what the pull recorded for each pulled application"""
+
+        info = dict()
+
+        sql = ('SELECT project_name, min_sdk_version, target_sdk_version, '
+               'version_name, version_code, apk_size, apk_md5 '
+               'FROM apps '
+               'WHERE successfully_pulled=1')
+
+        for line in self.app_db.execute(sql):
+            info[line[0]] = line[1:]
+        return info
+
+    def getAppPackageInfo(self):
+
+        """Return pull information for every application"""
+
+        info = dict()
+
+        sql = ('SELECT id, package_name, project_name, apk_size, apk_md5 '
+               'FROM apps '
+               'ORDER BY id')
+
+        for line in self.app_db.execute(sql):
+
+            _id = line[0]
+            package_name = line[1]
+            project_name = line[2]
+            apk_size = line[3]
+            apk_md5 = line[4]
+
+            info[project_name] = (_id, package_name, apk_size, apk_md5)
+        return info
+
     def getFailedToUnpackApps(self):
 
         """Return only the failed to unpack applications"""
@@ -1408,6 +1868,39 @@ class AppDb(object):
                                                         project_name)
             return None
 
+    def getAppSharedLibraries(self, application_id):
+
+        """Get the native libraries of an app"""
+
+        sql = ('SELECT id, name, abi, arch, soname, needed, size, md5 '
+               'FROM shared_libraries '
+               'WHERE application_id=? '
+               'ORDER BY id')
+
+        return [SharedLibrary(name, abi, arch, soname,
+                              needed.split(";") if needed else list(),
+                              size, md5, application_id, id=_id)
+                    for _id, name, abi, arch, soname, needed, size, md5
+                        in self.app_db.execute(sql, (application_id,))]
+
+    def getAppsBySharedLibrary(self, name, md5=None):
+
+        """Get apps bundling a library, by SONAME or file name"""
+
+        sql = ('SELECT DISTINCT application_id '
+               'FROM shared_libraries '
+               "WHERE (soname=? OR name=abi || '/' || ?)")
+        params = [name, name]
+
+        if md5 is not None:
+            sql += ' AND md5=?'
+            params.append(md5)
+
+        return [self.getAppById(line[0])
+                    for line in self.app_db.execute(sql + ' '
+                                                    'ORDER BY application_id',
+                                                    params).fetchall()]
+
     def getAppsBySharedUserId(self, shared_id_name):
 
         c = self.app_db.cursor()
@@ -1429,7 +1922,8 @@ class AppDb(object):
 
         rtn = c.execute('SELECT id, name, application_id '
                         'FROM permission_groups '
-                        "WHERE name=\"%s\"" % permission_group_name)
+                        "WHERE name=\"%s\" "
+                        'ORDER BY application_id, id' % permission_group_name)
 
         try:
             id, name, application_id = c.fetchone()
@@ -1462,7 +1956,8 @@ class AppDb(object):
         rtn = c.execute('SELECT id, name, permission_group, protection_level, '
                         'application_id '
                         'FROM permissions '
-                        "WHERE name=\"%s\"" % permission_name)
+                        "WHERE name=\"%s\" "
+                        'ORDER BY application_id, id' % permission_name)
 
         try:
             id, name, permission_group_id, protection_level, application_id = c.fetchone()
@@ -1545,6 +2040,21 @@ class AppDb(object):
 
         return perm_list
 
+    def getAppPermissionGroups(self, application_id):
+
+        group_list = list()
+        c = self.app_db.cursor()
+
+        sql = ('SELECT id, name '
+               'FROM permission_groups '
+               'WHERE application_id=%d' % application_id)
+
+        for line in c.execute(sql):
+            group_list.append(PermissionGroup(line[1], application_id,
+                                              id=line[0]))
+
+        return group_list
+
     def getAppUsesPermissions(self, application_id):
 
         uses_perm_list = list()
@@ -1562,6 +2072,39 @@ class AppDb(object):
 
         return uses_perm_list
 
+    def getGrantedPermissionIds(self, project_name=None,
+                                shared_user_id=None):
+
+        """Get the ids of every permission a caller is granted"""
+
+        # No caller means a third party app: normal|dangerous|development.
+        if project_name is not None:
+            granted = ('SELECT p.name FROM app_uses_permissions u '
+                       'JOIN permissions p ON p.id=u.permission_id '
+                       'JOIN apps a ON a.id=u.application_id '
+                       'WHERE a.project_name=?')
+            params = (project_name,)
+
+        elif shared_user_id is not None:
+            granted = ('SELECT p.name FROM app_uses_permissions u '
+                       'JOIN permissions p ON p.id=u.permission_id '
+                       'JOIN apps a ON a.id=u.application_id '
+                       'WHERE a.shared_user_id=?')
+            params = (shared_user_id,)
+
+        else:
+            granted = ('SELECT name FROM permissions '
+                       "WHERE protection_level IN "
+                       "('normal', 'dangerous', 'development')")
+            params = ()
+
+        # Access is granted by name, so every row with the name counts.
+        sql = ('SELECT id '
+               'FROM permissions '
+               'WHERE name IN (%s)' % granted)
+
+        return set(line[0] for line in self.app_db.execute(sql, params))
+
     def getAppActivities(self, app):
 
         activity_list = list()
@@ -1826,6 +2369,328 @@ class AppDb(object):
         except:
             return None
 
+    def getAppView(self, app):
+
+        """Get every component and permission of an app, in a few queries"""
+
+        application_id = app._id
+
+        # Permissions defined by the app, or used by it in any way.
+        sql = ('SELECT p.id, p.name, p.protection_level, p.application_id, '
+               'p.permission_group, g.name, g.application_id '
+               'FROM permissions p '
+               'LEFT JOIN permission_groups g ON g.id=p.permission_group '
+               'WHERE p.application_id=:app OR p.id IN ('
+               'SELECT permission FROM activities WHERE application_id=:app '
+               'UNION SELECT permission FROM services '
+               'WHERE application_id=:app '
+               'UNION SELECT permission FROM receivers '
+               'WHERE application_id=:app '
+               'UNION SELECT permission FROM providers '
+               'WHERE application_id=:app '
+               'UNION SELECT read_permission FROM providers '
+               'WHERE application_id=:app '
+               'UNION SELECT write_permission FROM providers '
+               'WHERE application_id=:app '
+               'UNION SELECT permission_id FROM app_uses_permissions '
+               'WHERE application_id=:app)')
+
+        permissions = dict()
+        for (_id, name, protection_level, perm_application_id, group_id,
+                group_name, group_application_id) in self.app_db.execute(
+                                            sql, {'app': application_id}):
+
+            if group_id != 0 and group_name is not None:
+                permission_group = PermissionGroup(group_name,
+                                                   group_application_id,
+                                                   id=group_id)
+            else:
+                permission_group = None
+
+            permissions[_id] = Permission(name, protection_level,
+                                          permission_group,
+                                          perm_application_id, id=_id)
+
+        def resolve(permission_id, default=None):
+
+            # The component perm takes precedence
+            if permission_id != 0:
+                return permissions.get(permission_id)
+            return default
+
+        view = dict()
+
+        for component_table, component_class in (('activities', Activity),
+                                                 ('services', Service),
+                                                 ('receivers', Receiver)):
+
+            sql = ('SELECT id, name, permission, exported, enabled '
+                   'FROM %s '
+                   'WHERE application_id=? '
+                   'ORDER BY id' % component_table)
+
+            view[component_table] = [
+                component_class(name, parseFlag(enabled), parseFlag(exported),
+                                resolve(permission_id, app.permission),
+                                application_id, id=_id)
+                    for _id, name, permission_id, exported, enabled
+                        in self.app_db.execute(sql, (application_id,))]
+
+        sql = ('SELECT id, authorities, name, permission, '
+               'read_permission, write_permission, '
+               'exported, enabled, grant_uri_permissions, '
+               'path_permission_data, grant_uri_permission_data '
+               'FROM providers '
+               'WHERE application_id=? '
+               'ORDER BY id')
+
+        view['providers'] = [
+            Provider(name, authorities.split(';'), parseFlag(enabled),
+                     parseFlag(exported), grant_uri_permissions,
+                     base64.b64decode(grant_uri_permission_data),
+                     base64.b64decode(path_permission_data),
+                     resolve(permission_id, app.permission),
+                     resolve(read_permission_id),
+                     resolve(write_permission_id), application_id, id=_id)
+                for (_id, authorities, name, permission_id,
+                     read_permission_id, write_permission_id, exported,
+                     enabled, grant_uri_permissions, path_permission_data,
+                     grant_uri_permission_data)
+                        in self.app_db.execute(sql, (application_id,))]
+
+        # Intent filters of all three component types at once.
+        sql = ' UNION ALL '.join(
+                    ('SELECT \'%(table)s\', l.id, l.%(id)s, f.id, f.priority '
+                     'FROM %(link)s l '
+                     'JOIN intent_filters f ON f.id=l.intent_filter_id '
+                     'JOIN %(table)s x ON x.id=l.%(id)s '
+                     'WHERE x.application_id=:app'
+                            % {'table': component_table, 'link': link_table,
+                               'id': id_name})
+                        for component_table, (link_table, id_name)
+                            in sorted(INTENT_FILTER_LINKS.items()))
+
+        filter_links = self.app_db.execute(sql + ' ORDER BY 1, 2',
+                                           {'app': application_id}).fetchall()
+
+        filter_ids = ','.join(str(line[3]) for line in filter_links)
+
+        actions = dict()
+        categories = dict()
+        datas = dict()
+        protected_actions = set()
+
+        if filter_ids != '':
+
+            sql = ('SELECT intent_filter_id, name FROM intent_actions '
+                   'WHERE intent_filter_id IN (%s) ORDER BY id' % filter_ids)
+            for filter_id, name in self.app_db.execute(sql):
+                actions.setdefault(filter_id, list()).append(name)
+
+            sql = ('SELECT intent_filter_id, name FROM intent_categories '
+                   'WHERE intent_filter_id IN (%s) ORDER BY id' % filter_ids)
+            for filter_id, name in self.app_db.execute(sql):
+                categories.setdefault(filter_id, list()).append(name)
+
+            sql = ('SELECT intent_filter_id, port, host, mime_type, path, '
+                   'path_pattern, path_prefix, scheme FROM intent_datas '
+                   'WHERE intent_filter_id IN (%s) ORDER BY id' % filter_ids)
+            for line in self.app_db.execute(sql):
+
+                tmp_data = IntentData()
+
+                (tmp_data.port, tmp_data.host, tmp_data.mime_type,
+                 tmp_data.path, tmp_data.path_pattern, tmp_data.path_prefix,
+                 tmp_data.scheme) = line[1:]
+
+                datas.setdefault(line[0], list()).append(tmp_data)
+
+            sql = ('SELECT DISTINCT name FROM protected_broadcasts '
+                   'WHERE name IN (SELECT name FROM intent_actions '
+                   'WHERE intent_filter_id IN (%s))' % filter_ids)
+            protected_actions.update(line[0]
+                                        for line in self.app_db.execute(sql))
+
+        intent_filters = dict()
+        for component_table, _, component_id, filter_id, priority in \
+                                                            filter_links:
+
+            intent_filters.setdefault((component_table, component_id),
+                                      list()).append(
+                IntentFilter(priority, actions.get(filter_id, []),
+                             categories.get(filter_id, []),
+                             datas.get(filter_id, [])))
+
+        for component_table in INTENT_FILTER_LINKS:
+            for component in view[component_table]:
+                component.intent_filters = intent_filters.get(
+                                    (component_table, component._id), [])
+
+        view['permissions'] = [permissions[_id]
+                                    for _id in sorted(permissions)
+                                        if permissions[_id].application_id ==
+                                                            application_id]
+
+        sql = ('SELECT permission_id FROM app_uses_permissions '
+               'WHERE application_id=? '
+               'ORDER BY id')
+
+        view['uses-permissions'] = [permissions.get(line[0])
+                                        for line in self.app_db.execute(
+                                                    sql, (application_id,))]
+
+        view['protected_actions'] = protected_actions
+
+        return view
+
+    def getIntentFilterFingerprints(self, component_table):
+
+        """Get a fingerprint of each component's intent filters, by id"""
+
+        link_table, id_name = INTENT_FILTER_LINKS[component_table]
+
+        # Every filter once (for the priority), then each element.
+        sql = ('SELECT l.%(id)s, f.id, f.priority, 0, \'\' '
+               'FROM %(link)s l '
+               'JOIN intent_filters f ON f.id=l.intent_filter_id '
+               'UNION ALL '
+               'SELECT l.%(id)s, f.id, f.priority, 1, ia.name '
+               'FROM %(link)s l '
+               'JOIN intent_filters f ON f.id=l.intent_filter_id '
+               'JOIN intent_actions ia ON ia.intent_filter_id=f.id '
+               'UNION ALL '
+               'SELECT l.%(id)s, f.id, f.priority, 2, ic.name '
+               'FROM %(link)s l '
+               'JOIN intent_filters f ON f.id=l.intent_filter_id '
+               'JOIN intent_categories ic ON ic.intent_filter_id=f.id '
+               'UNION ALL '
+               'SELECT l.%(id)s, f.id, f.priority, 3, '
+               "quote(port)||','||quote(host)||','||quote(mime_type)||','||"
+               "quote(path)||','||quote(path_pattern)||','||"
+               "quote(path_prefix)||','||quote(scheme) "
+               'FROM %(link)s l '
+               'JOIN intent_filters f ON f.id=l.intent_filter_id '
+               'JOIN intent_datas id ON id.intent_filter_id=f.id'
+                    % {'id': id_name, 'link': link_table})
+
+        filters = dict()
+        for component_id, filter_id, priority, kind, value in \
+                                                self.app_db.execute(sql):
+
+            component_filters = filters.setdefault(component_id, dict())
+            elements = component_filters.setdefault(filter_id, [priority])
+            if kind != 0:
+                elements.append(u"%d:%s" % (kind, value))
+
+        # Ids differ between databases, so only contents are hashed.
+        fingerprints = dict()
+        for component_id, component_filters in filters.iteritems():
+
+            texts = sorted(u"%s|%s" % (elements[0],
+                                       u'|'.join(sorted(elements[1:])))
+                                for elements in component_filters.values())
+
+            fingerprints[component_id] = getFingerprint(*texts)
+
+        return fingerprints
+
+    def getComponentFingerprints(self, component_table):
+
+        """Get {(app, name): {aspect: fingerprint}} for a component type"""
+
+        aspects = dict()
+
+        if component_table in INTENT_FILTER_LINKS:
+
+            filter_fingerprints = self.getIntentFilterFingerprints(
+                                                            component_table)
+            no_filters = getFingerprint()
+
+            # The app permission applies if the component has none.
+            sql = ('SELECT c.id, a.project_name, c.name, p.name, '
+                   'c.exported, c.enabled '
+                   'FROM %s c '
+                   'JOIN apps a ON a.id=c.application_id '
+                   'LEFT JOIN permissions p ON p.id!=0 AND p.id=(CASE '
+                   'WHEN c.permission!=0 THEN c.permission '
+                   'ELSE a.permission END) '
+                   'ORDER BY c.id' % component_table)
+
+            for (_id, project_name, name, permission, exported,
+                        enabled) in self.app_db.execute(sql):
+
+                aspects.setdefault((project_name, name), {
+                    'permission': getFingerprint(permission),
+                    'flags': getFingerprint(exported, enabled),
+                    'intent_filters': filter_fingerprints.get(_id,
+                                                              no_filters)})
+
+        elif component_table == 'providers':
+
+            sql = ('SELECT a.project_name, c.name, p.name, rp.name, wp.name, '
+                   'c.exported, c.enabled, c.authorities, '
+                   'c.grant_uri_permissions, c.grant_uri_permission_data, '
+                   'c.path_permission_data '
+                   'FROM providers c '
+                   'JOIN apps a ON a.id=c.application_id '
+                   'LEFT JOIN permissions p ON p.id!=0 AND p.id=(CASE '
+                   'WHEN c.permission!=0 THEN c.permission '
+                   'ELSE a.permission END) '
+                   'LEFT JOIN permissions rp ON rp.id!=0 '
+                   'AND rp.id=c.read_permission '
+                   'LEFT JOIN permissions wp ON wp.id!=0 '
+                   'AND wp.id=c.write_permission '
+                   'ORDER BY c.id')
+
+            for (project_name, name, permission, read_permission,
+                        write_permission, exported, enabled, authorities,
+                        grant_uri_permissions, grant_uri_permission_data,
+                        path_permission_data) in self.app_db.execute(sql):
+
+                aspects.setdefault((project_name, name), {
+                    'permission': getFingerprint(permission),
+                    'read_permission': getFingerprint(read_permission),
+                    'write_permission': getFingerprint(write_permission),
+                    'flags': getFingerprint(exported, enabled),
+                    'authorities': getFingerprint(authorities),
+                    'uri_permissions': getFingerprint(grant_uri_permissions,
+                                                grant_uri_permission_data,
+                                                path_permission_data)})
+
+        elif component_table == 'permissions':
+
+            sql = ('SELECT a.project_name, p.name, p.protection_level, '
+                   'g.name '
+                   'FROM permissions p '
+                   'JOIN apps a ON a.id=p.application_id '
+                   'LEFT JOIN permission_groups g ON g.id!=0 '
+                   'AND g.id=p.permission_group '
+                   'ORDER BY p.id')
+
+            for (project_name, name, protection_level,
+                        group) in self.app_db.execute(sql):
+
+                aspects.setdefault((project_name, name), {
+                    'protection_level': getFingerprint(protection_level),
+                    'permission_group': getFingerprint(group)})
+
+        elif component_table == 'uses-permissions':
+
+            sql = ('SELECT a.project_name, p.name '
+                   'FROM app_uses_permissions u '
+                   'JOIN apps a ON a.id=u.application_id '
+                   'JOIN permissions p ON p.id=u.permission_id '
+                   'ORDER BY u.id')
+
+            for project_name, name in self.app_db.execute(sql):
+                aspects.setdefault((project_name, name), dict())
+
+        else:
+            raise AppDbException("Unknown component type: %s"
+                                                    % component_table)
+
+        return aspects
+
     def getIntentFilters(self, component):
 
         intent_filters = list()
@@ -1909,12 +2774,33 @@ class AppDb(object):
 
         return intent_filters
 
-    def getPermissions(self):
+    def getPermissionUsage(self, permission_name, roles=None):
+
+        """Get (role, type, component, project name) users of a permission"""
+
+        # Permissions are enforced by name, so any row with it counts.
+        sql = ('SELECT u.role, u.component_type, u.component_name, '
+               'a.project_name '
+               'FROM permission_usage u '
+               'JOIN apps a ON a.id=u.application_id '
+               'WHERE u.permission_id IN '
+               '(SELECT id FROM permissions WHERE name=?)')
+        params = [permission_name]
+
+        if roles is not None:
+            sql += ' AND u.role IN (%s)' % ','.join('?' * len(roles))
+            params.extend(roles)
+
+        return self.app_db.execute(sql + ' ORDER BY a.id, u.component_id',
+                                   params).fetchall()
+
+    def getPermissions(self, order_by_app=False):
 
         sql = ('SELECT id, name, permission_group, '
                'protection_level, application_id '
                'FROM permissions '
-               'ORDER BY name')
+               'ORDER BY %s' % ('application_id, id' if order_by_app
+                                                        else 'name'))
 
         perm_list = list()
         c = self.app_db.cursor()
@@ -1936,7 +2822,98 @@ class AppDb(object):
 
         return perm_list
 
+    def getPermissionGroups(self):
+
+        """Get every permission group, by app and then in the order added"""
+
+        sql = ('SELECT id, name, application_id '
+               'FROM permission_groups '
+               'ORDER BY application_id, id')
+
+        return [PermissionGroup(name, application_id, id=_id)
+                    for _id, name, application_id in self.app_db.execute(sql)]
+
+    def getAppDigests(self):
+
+        """Get the (manifest, libs, signature) digests of each app ID"""
+
+        sql = ('SELECT id, manifest_digest, libs_digest, signature_digest '
+               'FROM apps')
+
+        return dict((line[0], tuple(line[1:]))
+                        for line in self.app_db.execute(sql))
+
+    def getSignatureIds(self):
+
+        """Get (certificate, signature ID) pairs, in the order added"""
+
+        sql = ('SELECT certificate, id '
+               'FROM signatures '
+               'ORDER BY id')
+
+        return self.app_db.execute(sql).fetchall()
+
 ########### Update Methods ########################
+    def relinkPermission(self, old_id, new_id):
+
+        """Point references to a replaced permission at its new row"""
+
+        for table, column in [('activities', 'permission'),
+                              ('services', 'permission'),
+                              ('receivers', 'permission'),
+                              ('providers', 'permission'),
+                              ('providers', 'read_permission'),
+                              ('providers', 'write_permission'),
+                              ('apps', 'permission'),
+                              ('app_uses_permissions', 'permission_id')]:
+
+            self.app_db.execute('UPDATE %s SET %s=? WHERE %s=?'
+                                % (table, column, column), (new_id, old_id))
+
+        # A uses-permission on a permission that is now gone is meaningless.
+        self.app_db.execute('DELETE FROM app_uses_permissions '
+                            'WHERE permission_id=0')
+        return 0
+
+    def relinkPermissionGroup(self, old_id, new_id):
+
+        """Point permissions at the new row of a replaced group"""
+
+        return self.app_db.execute('UPDATE permissions '
+                                   'SET permission_group=? '
+                                   'WHERE permission_group=?',
+                                   (new_id, old_id))
+
+    def setHasNative(self, application_id, has_native):
+
+        """Record whether an app bundles native code"""
+
+        return self.app_db.execute('UPDATE apps '
+                                   'SET has_native=? '
+                                   'WHERE id=?',
+                                   (has_native, application_id))
+
+    def setDexCount(self, application_id, dex_count):
+
+        """Record how many DEX files were decoded for an app"""
+
+        return self.app_db.execute('UPDATE apps '
+                                   'SET dex_count=? '
+                                   'WHERE id=?',
+                                   (dex_count, application_id))
+
+    def setAppDigests(self, application_id, manifest_digest, libs_digest,
+                      signature_digest):
+
+        """Record what an app was processed from"""
+
+        return self.app_db.execute('UPDATE apps '
+                                   'SET manifest_digest=?, libs_digest=?, '
+                                   'signature_digest=? '
+                                   'WHERE id=?',
+                                   (manifest_digest, libs_digest,
+                                    signature_digest, application_id))
+
     def updateApplication(self, a):
 
         if a.permission is None: